@@ -30,17 +30,24 @@
 from datetime import date, time, datetime
 
 # %%
-import locale
-
-locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
 
 # %%
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import polars as pl
+import duckdb
+import requests_cache
 
 import plotly.io as pio
 import plotly.express as px
 import folium
+from folium.plugins import FastMarkerCluster
 
 # %%
 pio.templates.default='plotly_dark'
@@ -55,18 +62,120 @@ pio.templates.default='plotly_dark'
 
 # %% [markdown]
 # ## Loading the tables
+#
+# The CSV files are downloaded from Cenipa only once and then kept in
+# the `data` directory as Parquet files, which are a lot faster to read.
+# The HTTP responses are cached there as well, in `cenipa_http.sqlite`,
+# for a day, after which the server is asked whether the files have
+# changed, so unchanged files are not downloaded again. Removing the
+# Parquet files rebuilds them from that HTTP cache, so to get fresh data
+# within a day of the last download remove `cenipa_http.sqlite` too.
+# The HTTP cache keeps each response body in memory while storing
+# it, but the CSV is written to disk and parsed from there in a streaming
+# fashion, so the parsed table is never fully in memory. The Parquet
+# files keep every column, but only the ones listed in `USED_COLUMNS`
+# are loaded.
+#
+# Columns are kept in Arrow-backed dtypes, so strings are stored as Arrow
+# arrays and integer columns with missing values are not turned into
+# floats.
 
 # %%
-df_tipo_ocorrencia = pd.read_csv('http://sistema.cenipa.aer.mil.br/cenipa/media/opendata/ocorrencia_tipo.csv', sep=';')
-
-# %%
-df_aeronave = pd.read_csv('http://sistema.cenipa.aer.mil.br/cenipa/media/opendata/aeronave.csv', sep=';')
+CENIPA_OPENDATA_URL = 'http://sistema.cenipa.aer.mil.br/cenipa/media/opendata/{name}.csv'
+DATA_DIR = Path('data')
+DATA_DIR.mkdir(exist_ok=True)
 
-# %%
-df_fator_contribuinte = pd.read_csv('http://sistema.cenipa.aer.mil.br/cenipa/media/opendata/fator_contribuinte.csv', sep=';')
+# the same tokens pandas' read_csv treats as missing by default, Polars
+# would otherwise only take empty fields as missing
+NA_VALUES = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+    '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None',
+    'n/a', 'nan', 'null',
+]
 
-# %%
-df_ocorrencia = pd.read_csv('http://sistema.cenipa.aer.mil.br/cenipa/media/opendata/ocorrencia.csv', sep=';')
+session = requests_cache.CachedSession(DATA_DIR / 'cenipa_http', expire_after=86400)
+
+def fetch(url: str, destination: Path):
+    with session.get(url, stream=True) as response:
+        response.raise_for_status()
+        with open(destination, 'wb') as file:
+            for chunk in response.iter_content(chunk_size=1 << 20):
+                file.write(chunk)
+
+# only the columns used in this notebook are read from the Parquet files
+USED_COLUMNS = {
+    'ocorrencia_tipo': [
+        'ocorrencia_tipo',
+        'ocorrencia_tipo_categoria',
+    ],
+    'aeronave': [
+        'aeronave_tipo_veiculo',
+        'aeronave_operador_categoria',
+        'aeronave_fabricante',
+        'aeronave_modelo',
+        'aeronave_motor_quantidade',
+        'aeronave_assentos',
+        'aeronave_ano_fabricacao',
+        'aeronave_voo_origem',
+        'aeronave_voo_destino',
+        'aeronave_fase_operacao',
+        'aeronave_tipo_operacao',
+        'aeronave_nivel_dano',
+        'aeronave_fatalidades_total',
+    ],
+    'fator_contribuinte': [
+        'fator_nome',
+        'fator_area',
+        'fator_condicionante',
+    ],
+    'ocorrencia': [
+        'codigo_ocorrencia',
+        'ocorrencia_classificacao',
+        'ocorrencia_dia',
+        'ocorrencia_hora',
+        'ocorrencia_cidade',
+        'ocorrencia_uf',
+        'ocorrencia_latitude',
+        'ocorrencia_longitude',
+        'investigacao_status',
+        'total_aeronaves_envolvidas',
+    ],
+}
+
+# the Arrow tables are kept in memory until their Parquet file changes,
+# while every load gets a fresh pandas frame the cleanup can modify
+@lru_cache(maxsize=None)
+def read_table(name: str, modified: int) -> pa.Table:
+    return pq.read_table(DATA_DIR / f'{name}.parquet', columns=USED_COLUMNS[name])
+
+def load(name: str) -> pd.DataFrame:
+    path = DATA_DIR / f'{name}.parquet'
+    if not path.exists():
+        # written to a temporary file first, so a failed download or parse
+        # never leaves a truncated Parquet file behind
+        csv_path = path.with_suffix('.csv')
+        temporary_path = path.with_suffix('.parquet.tmp')
+        fetch(CENIPA_OPENDATA_URL.format(name=name), csv_path)
+        (
+            pl.scan_csv(csv_path, separator=';', null_values=NA_VALUES, infer_schema_length=None)
+            .sink_parquet(temporary_path, compression='zstd')
+        )
+        temporary_path.replace(path)
+        csv_path.unlink()
+    return read_table(name, path.stat().st_mtime_ns).to_pandas(types_mapper=pd.ArrowDtype)
+
+
+# %%
+df_tipo_ocorrencia = load('ocorrencia_tipo')
+
+# %%
+df_aeronave = load('aeronave')
+
+# %%
+df_fator_contribuinte = load('fator_contribuinte')
+
+# %%
+df_ocorrencia = load('ocorrencia')
 
 # %% [markdown]
 # ### Data quality checks
@@ -111,33 +220,106 @@ df_ocorrencia[(df_ocorrencia.ocorrencia_latitude < -55) | (df_ocorrencia.ocorren
 # ### Cleanup
 
 # %%
-df_ocorrencia['ocorrencia_data'] = df_ocorrencia.apply(
-    lambda row: datetime.strptime(
-        row['ocorrencia_dia'] + ' ' +
-        (row['ocorrencia_hora'] if isinstance(row['ocorrencia_hora'], str) else '00:00:00'), '%d/%m/%Y %H:%M:%S'),
-    axis=1
+df_ocorrencia['ocorrencia_data'] = pd.to_datetime(
+    df_ocorrencia['ocorrencia_dia'] + ' ' +
+    df_ocorrencia['ocorrencia_hora'].fillna('00:00:00'),
+    format='%d/%m/%Y %H:%M:%S',
+    errors='coerce',
+    cache=True,
 )
 
 
 # %%
-def clean_float(original: str) -> float:
-    if isinstance(original, float):
-        return original
-    try:
-        return locale.atof(original)
-    except ValueError:
-        return np.NaN
+def to_float(original: pd.Series) -> pd.Series:
+    return pd.to_numeric(
+        original.astype('string').str.replace(',', '.', regex=False),
+        errors='coerce'
+    )
 
-df_ocorrencia['ocorrencia_latitude'] = df_ocorrencia['ocorrencia_latitude'].apply(clean_float)
-df_ocorrencia['ocorrencia_longitude'] = df_ocorrencia['ocorrencia_longitude'].apply(clean_float)
+df_ocorrencia['ocorrencia_latitude'] = to_float(df_ocorrencia['ocorrencia_latitude'])
+df_ocorrencia['ocorrencia_longitude'] = to_float(df_ocorrencia['ocorrencia_longitude'])
 
 # %%
 # separates the category type
 df_tipo_ocorrencia['ocorrencia_tipo_categoria'] = \
     df_tipo_ocorrencia['ocorrencia_tipo_categoria'].apply(lambda t: t.split('|')[0].strip())
 
+# %%
+# columns with just a handful of distinct values are stored as categories
+for df, columns in (
+    (df_ocorrencia, ['ocorrencia_classificacao', 'investigacao_status']),
+    (df_aeronave, ['aeronave_tipo_veiculo', 'aeronave_operador_categoria', 'aeronave_fabricante']),
+    (df_fator_contribuinte, ['fator_area', 'fator_condicionante']),
+):
+    for column in columns:
+        df[column] = df[column].astype('category')
+
+# damage levels have a natural order, from no damage to destroyed. Any
+# other level found in the data (e.g. undetermined) is kept, ordered
+# before no damage, so it is not lost when casting.
+DAMAGE_SCALE = ['NENHUM', 'LEVE', 'SUBSTANCIAL', 'DESTRUÍDA']
+unknown_damage_levels = sorted(
+    set(df_aeronave['aeronave_nivel_dano'].dropna().unique()) - set(DAMAGE_SCALE)
+)
+DAMAGE_LEVEL = pd.CategoricalDtype(unknown_damage_levels + DAMAGE_SCALE, ordered=True)
+df_aeronave['aeronave_nivel_dano'] = df_aeronave['aeronave_nivel_dano'].astype(DAMAGE_LEVEL)
+
 # %% [markdown]
 # ## Basic data exploration
+#
+# Most of the exploration consists of counting values. The tables are
+# registered in DuckDB so that those counts are done by SQL queries,
+# which are vectorized and multi-threaded.
+
+# %%
+# counts are shown as horizontal bars, the largest one on top
+def hbar(counts: pd.Series, title: str, category: str, quantity: str = 'quantity'):
+    return px.bar(
+        counts,
+        orientation='h',
+        title=title,
+        labels={
+            'index': category,
+            'value': quantity,
+        }
+    ).update_yaxes(categoryorder='total ascending')
+
+# %%
+con = duckdb.connect()
+con.register('ocorrencia', df_ocorrencia)
+con.register('tipo_ocorrencia', df_tipo_ocorrencia)
+con.register('aeronave', df_aeronave)
+con.register('fator_contribuinte', df_fator_contribuinte)
+
+# count() is used for full counts and for counts that need a SQL filter
+# or expression, top() for the most common values of a plain column.
+# The tables do not change from here on, so each count is computed only once.
+@lru_cache(maxsize=None)
+def count(table: str, column: str, where: str = 'TRUE', limit: Optional[int] = None) -> pd.Series:
+    counts = con.sql(f'''
+        SELECT {column} AS "index", count(*) AS "count"
+        FROM {table}
+        WHERE ({column}) IS NOT NULL AND ({where})
+        GROUP BY 1
+        ORDER BY 2 DESC, 1
+        {f'LIMIT {limit}' if limit else ''}
+    ''').df()
+    # not named 'value', which plotly would rename to '_value', losing the axis label
+    return counts.set_index('index')['count']
+
+# the most common values of a column, picking the top k counts without
+# sorting all of them
+def top(values: pd.Series, k: int) -> pd.Series:
+    values = pa.array(values)
+    if pa.types.is_dictionary(values.type):
+        # categorical columns are counted by their values
+        values = values.dictionary_decode()
+    counts = pc.value_counts(pc.drop_null(values))
+    counts = pa.table({'index': counts.field('values'), 'count': counts.field('counts')})
+    counts = counts.take(pc.select_k_unstable(
+        counts, k, sort_keys=[('count', 'descending'), ('index', 'ascending')]
+    ))
+    return counts.to_pandas().set_index('index')['count']
 
 # %% [markdown]
 # ### Occurrence
@@ -146,87 +328,97 @@ df_tipo_ocorrencia['ocorrencia_tipo_categoria'] = \
 df_ocorrencia.info()
 
 # %%
-occurencies_in_time = df_ocorrencia.groupby(pd.Grouper(key='ocorrencia_data', axis=0, freq='M')).codigo_ocorrencia.count()
+# a single pass counts occurrences by month and class, the monthly
+# totals are then summed up from those counts. Grouping is done on the
+# date truncated to the month by numpy and on the integer codes of the
+# classes, which are only mapped back to their names at the end.
+month = df_ocorrencia['ocorrencia_data'].to_numpy().astype('datetime64[M]')
+class_code = df_ocorrencia['ocorrencia_classificacao'].cat.codes.to_numpy()
+by_month_and_class = df_ocorrencia.groupby([month, class_code]).size()
+occurrence_in_time_by_class = pd.DataFrame({
+    'month': by_month_and_class.index.get_level_values(0),
+    'ocorrencia_classificacao': pd.Categorical.from_codes(
+        by_month_and_class.index.get_level_values(1),
+        categories=df_ocorrencia['ocorrencia_classificacao'].cat.categories
+    ),
+    'quantity': by_month_and_class.to_numpy(),
+})
+occurencies_in_time = by_month_and_class.groupby(level=0).sum().rename_axis('month')
 occurencies_in_time
 
 # %%
 px.line(
     occurencies_in_time,
     title='Occurencies per month',
-    labels={
-        'index': 'date',
-        'ocorrencia_data': 'month'
-    }
 )
 
 # %%
-df_ocorrencia.ocorrencia_classificacao.value_counts()
+occurrence_class = count('ocorrencia', 'ocorrencia_classificacao')
+occurrence_class
 
 # %%
-px.bar(
-    df_ocorrencia.ocorrencia_classificacao.value_counts().iloc[::-1],
-    orientation='h',
-    title='Occurrence class',
-    labels={
-        'index': 'category',
-        'value': 'quantity',
-    }
-)
+hbar(occurrence_class, 'Occurrence class', 'category')
 
 # %%
-occurrence_in_time_by_class = (
-    df_ocorrencia
-    .set_index('ocorrencia_data')
-    .groupby([pd.Grouper(freq='M'), 'ocorrencia_classificacao'])
-    .codigo_ocorrencia
-    .count()
-)
 occurrence_in_time_by_class
 
 # %%
 px.line(
     occurrence_in_time_by_class,
-    x=occurrence_in_time_by_class.index.get_level_values(0),
-    y=occurrence_in_time_by_class.values,
-    color=occurrence_in_time_by_class.index.get_level_values(1),
+    x='month',
+    y='quantity',
+    color='ocorrencia_classificacao',
     title='Occurencies by class per month',
-    labels={
-        'x': 'category',
-        'y': 'quantity',
-    }
 )
 
 # %%
-accidents = df_ocorrencia[df_ocorrencia.ocorrencia_classificacao == 'ACIDENTE']
+popup_columns = [
+    'codigo_ocorrencia',
+    'ocorrencia_dia',
+    'ocorrencia_hora',
+    'ocorrencia_classificacao',
+    'ocorrencia_cidade',
+]
 
 # %%
-accidents_2020 = accidents[accidents.ocorrencia_data >= datetime(2020,1,1)]
+# accidents since 2020 which have a known location, filtered in a single pass
+accidents_2020 = df_ocorrencia.loc[
+    (df_ocorrencia.ocorrencia_classificacao == 'ACIDENTE').to_numpy() &
+    (df_ocorrencia.ocorrencia_data >= datetime(2020,1,1)).to_numpy() &
+    df_ocorrencia.ocorrencia_latitude.notna().to_numpy(),
+    ['ocorrencia_latitude', 'ocorrencia_longitude'] + popup_columns
+]
 
 # %%
-len(accidents_2020[accidents_2020.ocorrencia_latitude.notna()])
+len(accidents_2020)
 
 # %% [markdown]
 # There were 237 accidents in 2020. Let's see the location of those accidents in a map.
 
 # %%
 m = folium.Map(location=[-15.24,-51.33], zoom_start=4)
-for occurence in accidents_2020[accidents_2020.ocorrencia_latitude.notna()].itertuples():
-    folium.Marker(
-        [occurence.ocorrencia_latitude, occurence.ocorrencia_longitude],
-        popup=(
-            '<dl>'
-            f'<dt>Código:<dt><dd>{occurence.codigo_ocorrencia}</dd>'
-            f'<dt>Data:<dt><dd>{occurence.ocorrencia_dia}</dd>'
-            f'<dt>Hora:<dt><dd>{occurence.ocorrencia_hora}</dd>'
-            f'<dt>Classificação:</dt><dd>{occurence.ocorrencia_classificacao}</dd>'
-            f'<dt>Cidade:</dt><dd>{occurence.ocorrencia_cidade}</dd>'
+FastMarkerCluster(
+    accidents_2020.astype({column: str for column in popup_columns}).to_numpy(),
+    callback='''
+    function (row) {
+        var marker = L.marker(new L.LatLng(row[0], row[1]));
+        marker.bindPopup(
+            '<dl>' +
+            '<dt>Código:</dt><dd>' + row[2] + '</dd>' +
+            '<dt>Data:</dt><dd>' + row[3] + '</dd>' +
+            '<dt>Hora:</dt><dd>' + row[4] + '</dd>' +
+            '<dt>Classificação:</dt><dd>' + row[5] + '</dd>' +
+            '<dt>Cidade:</dt><dd>' + row[6] + '</dd>' +
             '</dl>'
-        ),
-    ).add_to(m)
+        );
+        return marker;
+    }
+    ''',
+).add_to(m)
 m
 
 # %%
-investigation_status = df_ocorrencia.investigacao_status.value_counts()
+investigation_status = count('ocorrencia', 'investigacao_status')
 investigation_status
 
 # %% [markdown]
@@ -242,18 +434,11 @@ px.pie(
 )
 
 # %%
-df_ocorrencia.total_aeronaves_envolvidas.value_counts()
+aircraft_involved = count('ocorrencia', 'total_aeronaves_envolvidas')
+aircraft_involved
 
 # %%
-px.bar(
-    df_ocorrencia.total_aeronaves_envolvidas.value_counts(),
-    orientation='h',
-    title='Number of aircraft involved',
-    labels={
-        'index': 'number of aircraft',
-        'value': 'occurencies',
-    }
-)
+hbar(aircraft_involved, 'Number of aircraft involved', 'number of aircraft', 'occurencies')
 
 # %% [markdown]
 # ### Occurrence type
@@ -262,34 +447,18 @@ px.bar(
 df_tipo_ocorrencia.info()
 
 # %%
-most_common_occurrence_types = df_tipo_ocorrencia.ocorrencia_tipo.value_counts().head(10)
+most_common_occurrence_types = top(df_tipo_ocorrencia.ocorrencia_tipo, 10)
 most_common_occurrence_types
 
 # %%
-px.bar(
-    most_common_occurrence_types.iloc[::-1],
-    orientation='h',
-    title='Most common occurrence types',
-    labels={
-        'index': 'category',
-        'value': 'quantity',
-    }
-)
+hbar(most_common_occurrence_types, 'Most common occurrence types', 'category')
 
 # %%
-most_common_occurrence_categories = df_tipo_ocorrencia.ocorrencia_tipo_categoria.value_counts().head(10)
+most_common_occurrence_categories = top(df_tipo_ocorrencia.ocorrencia_tipo_categoria, 10)
 most_common_occurrence_categories
 
 # %%
-px.bar(
-    most_common_occurrence_categories.iloc[::-1],
-    orientation='h',
-    title='Most common occurrence categories',
-    labels={
-        'index': 'category',
-        'value': 'quantity',
-    }
-)
+hbar(most_common_occurrence_categories, 'Most common occurrence categories', 'category')
 
 # %% [markdown]
 # ### Aircraft
@@ -298,84 +467,43 @@ px.bar(
 df_aeronave.info()
 
 # %%
-aircraft_types = df_aeronave.aeronave_tipo_veiculo.value_counts()
+aircraft_types = count('aeronave', 'aeronave_tipo_veiculo')
 aircraft_types
 
 # %%
-px.bar(
-    aircraft_types.iloc[::-1],
-    orientation='h',
-    title='Aircraft types',
-    labels={
-        'index': 'aircraft type',
-        'value': 'quantity',
-    }
-)
+hbar(aircraft_types, 'Aircraft types', 'aircraft type')
 
 # %%
-aircraft_operator_type = df_aeronave.aeronave_operador_categoria.value_counts()
+aircraft_operator_type = count('aeronave', 'aeronave_operador_categoria')
 aircraft_operator_type
 
 # %%
-px.bar(
-    aircraft_operator_type.iloc[:0:-1],
-    orientation='h',
-    title='Aircraft operator type',
-    labels={
-        'index': 'operator type',
-        'value': 'quantity',
-    }
-)
+hbar(aircraft_operator_type.iloc[1:], 'Aircraft operator type', 'operator type')
 
 # %%
-most_common_aircraft_makers = df_aeronave.aeronave_fabricante.value_counts().head(10)
+most_common_aircraft_makers = top(df_aeronave.aeronave_fabricante, 10)
 most_common_aircraft_makers
 
 # %%
-px.bar(
-    most_common_aircraft_makers.iloc[::-1],
-    orientation='h',
-    title='Most common aircraft makers',
-    labels={
-        'index': 'maker',
-        'value': 'quantity',
-    }
-)
+hbar(most_common_aircraft_makers, 'Most common aircraft makers', 'maker')
 
 # %%
-most_common_aircraft_make_models = (
-    df_aeronave[['aeronave_fabricante','aeronave_modelo']]
-    .apply(lambda row: ' '.join(row), axis=1)
-    .value_counts()
-    .head(10)
+most_common_aircraft_make_models = count(
+    'aeronave',
+    "aeronave_fabricante::VARCHAR || ' ' || aeronave_modelo",
+    limit=10
 )
 most_common_aircraft_make_models
 
 # %%
-px.bar(
-    most_common_aircraft_make_models.iloc[::-1],
-    orientation='h',
-    title='Most common aircraft make and models',
-    labels={
-        'index': 'make and model',
-        'value': 'quantity',
-    }
-)
+hbar(most_common_aircraft_make_models, 'Most common aircraft make and models', 'make and model')
 
 # %%
-aircraft_motor_quantity = df_aeronave.aeronave_motor_quantidade.value_counts()
+aircraft_motor_quantity = count('aeronave', 'aeronave_motor_quantidade')
 aircraft_motor_quantity
 
 # %%
-px.bar(
-    aircraft_motor_quantity.iloc[::-1],
-    orientation='h',
-    title='Aircraft motor quantity',
-    labels={
-        'index': 'motor quantity',
-        'value': 'quantity',
-    }
-)
+hbar(aircraft_motor_quantity, 'Aircraft motor quantity', 'motor quantity')
 
 # %% [markdown]
 # People often say that accidents happen more often with
@@ -385,7 +513,7 @@ px.bar(
 df_aeronave.aeronave_assentos.describe()
 
 # %%
-df_aeronave.aeronave_assentos.value_counts()
+count('aeronave', 'aeronave_assentos')
 
 # %%
 px.box(
@@ -425,96 +553,67 @@ px.box(
 # Most common airdromes.
 
 # %%
-most_common_origin_airdromes = df_aeronave.aeronave_voo_origem.value_counts().head(12)
+most_common_origin_airdromes = top(df_aeronave.aeronave_voo_origem, 12)
 most_common_origin_airdromes
 
 # %%
-px.bar(
-    most_common_origin_airdromes.iloc[:1:-1],
-    orientation='h',
-    title='Most common airdromes of origin',
-    labels={
-        'index': 'airdrome',
-        'value': 'quantity',
-    }
-)
+hbar(most_common_origin_airdromes.iloc[2:], 'Most common airdromes of origin', 'airdrome')
 
 # %%
-most_common_destination_airdromes = df_aeronave.aeronave_voo_destino.value_counts().head(12)
+most_common_destination_airdromes = top(df_aeronave.aeronave_voo_destino, 12)
 most_common_destination_airdromes
 
 # %%
-px.bar(
-    most_common_destination_airdromes.iloc[:1:-1],
-    orientation='h',
-    title='Most common destination airdromes',
-    labels={
-        'index': 'airdrome',
-        'value': 'quantity',
-    }
-)
+hbar(most_common_destination_airdromes.iloc[2:], 'Most common destination airdromes', 'airdrome')
 
 # %%
-operational_phases = df_aeronave.aeronave_fase_operacao.value_counts().head(10)
+operational_phases = top(df_aeronave.aeronave_fase_operacao, 10)
 operational_phases
 
 # %%
-px.bar(
-    operational_phases.iloc[::-1],
-    orientation='h',
-    title='Operational phases',
-    labels={
-        'index': 'phase',
-        'value': 'quantity',
-    }
-)
+hbar(operational_phases, 'Operational phases', 'phase')
 
 # %%
-operation_type = df_aeronave.aeronave_tipo_operacao.value_counts()
+operation_type = count('aeronave', 'aeronave_tipo_operacao')
 operation_type
 
 # %%
-px.bar(
-    operation_type.iloc[::-1],
-    orientation='h',
-    title='Operation type',
-    labels={
-        'index': 'category',
-        'value': 'quantity',
-    }
-)
+hbar(operation_type, 'Operation type', 'category')
 
 # %%
-damage_level = df_aeronave.aeronave_nivel_dano.value_counts()
+damage_level = count('aeronave', 'aeronave_nivel_dano')
 damage_level
 
 # %%
-px.bar(
-    damage_level.iloc[::-1],
-    orientation='h',
-    title='Damage level',
-    labels={
-        'index': 'level',
-        'value': 'quantity',
-    }
-)
+hbar(damage_level, 'Damage level', 'level')
 
 # %%
-df_aeronave.aeronave_fatalidades_total.value_counts()
+count('aeronave', 'aeronave_fatalidades_total')
 
 # %% [markdown]
 # Most occurrences do not involve fatalities. Let's exclude the ones where there have been no damage to the aircraft and see the number of fatalities there.
 
 # %%
-df_aeronave[df_aeronave.aeronave_nivel_dano != 'NENHUM'].aeronave_fatalidades_total.value_counts()
+# the damage analyses only need two columns, so they are kept apart in a
+# narrow frame. Damage levels are ordered, so filters compare their
+# integer codes.
+damage = pd.DataFrame({
+    'level_code': df_aeronave.aeronave_nivel_dano.cat.codes.to_numpy(np.int8),
+    'fatalities': df_aeronave.aeronave_fatalidades_total.array,
+})
+
+# %%
+damage.fatalities[
+    damage.level_code != DAMAGE_LEVEL.categories.get_loc('NENHUM')
+].value_counts()
 
 # %% [markdown]
 # Now also without the occurrences where the aircraft has been lightly damaged.
 
 # %%
-substantial_damage_or_more = df_aeronave[
-    ~df_aeronave.aeronave_nivel_dano.isin(['NENHUM', 'LEVE'])
-].aeronave_fatalidades_total
+substantial_damage_or_more = damage.fatalities[
+    damage.level_code >= DAMAGE_LEVEL.categories.get_loc('SUBSTANCIAL')
+]
 substantial_damage_or_more.value_counts()
 
 # %%
@@ -531,7 +630,9 @@ px.box(
 )
 
 # %%
-fatalities_aircraft_destroyed = df_aeronave[df_aeronave.aeronave_nivel_dano == 'DESTRUÍDA'].aeronave_fatalidades_total
+fatalities_aircraft_destroyed = damage.fatalities[
+    damage.level_code == DAMAGE_LEVEL.categories.get_loc('DESTRUÍDA')
+]
 
 # %%
 fatalities_aircraft_destroyed.describe()
@@ -556,101 +657,67 @@ df_fator_contribuinte.info()
 df_fator_contribuinte
 
 # %%
-contributing_factor_area = df_fator_contribuinte.fator_area.value_counts()
+contributing_factor_area = count('fator_contribuinte', 'fator_area')
 contributing_factor_area
 
 # %%
-px.bar(
-    contributing_factor_area.iloc[::-1],
-    orientation='h',
-    title='Area of contributing factor',
-    labels={
-        'index': 'category',
-        'value': 'quantity',
-    }
-)
+hbar(contributing_factor_area, 'Area of contributing factor', 'category')
 
 # %% [markdown]
 # Operational factors are the most common. Let's explore
 # which conditional factors happen more often in this case.
 
 # %%
-operational_factor_conditioning = \
-    df_fator_contribuinte[df_fator_contribuinte.fator_area == 'FATOR OPERACIONAL']
-operational_factor_conditioning['fator_condicionante'].value_counts()
+con.execute('''
+    CREATE OR REPLACE TABLE fator_operacional AS
+    SELECT * FROM fator_contribuinte WHERE fator_area = 'FATOR OPERACIONAL'
+''')
+operational_factor_conditioning = count('fator_operacional', 'fator_condicionante')
+operational_factor_conditioning
 
 # %%
-px.bar(
-    operational_factor_conditioning['fator_condicionante'].value_counts().iloc[::-1],
-    orientation='h',
-    title='Conditioning of operational factors',
-    labels={
-        'index': 'category',
-        'value': 'quantity',
-    }
-)
-
-# %%
-aircraft_operation = operational_factor_conditioning[
-    operational_factor_conditioning.fator_condicionante == 'OPERAÇÃO DA AERONAVE'
-]
-aircraft_operation.fator_nome.value_counts()
+hbar(operational_factor_conditioning, 'Conditioning of operational factors', 'category')
 
 # %%
-px.bar(
-    aircraft_operation.fator_nome.value_counts().head(10).iloc[::-1],
-    orientation='h',
-    title='Most common aircraft operational factors',
-    labels={
-        'index': 'factor',
-        'value': 'quantity',
-    }
+aircraft_operation = count(
+    'fator_operacional',
+    'fator_nome',
+    where="fator_condicionante = 'OPERAÇÃO DA AERONAVE'"
 )
+aircraft_operation
 
 # %%
-human_factor_conditioning = \
-    df_fator_contribuinte[df_fator_contribuinte.fator_area == 'FATOR HUMANO']
-human_factor_conditioning['fator_condicionante'].value_counts()
+hbar(aircraft_operation.head(10), 'Most common aircraft operational factors', 'factor')
 
 # %%
-px.bar(
-    human_factor_conditioning['fator_condicionante'].value_counts().iloc[::-1],
-    orientation='h',
-    title='Conditioning of human factors',
-    labels={
-        'index': 'category',
-        'value': 'quantity',
-    }
-)
+con.execute('''
+    CREATE OR REPLACE TABLE fator_humano AS
+    SELECT * FROM fator_contribuinte WHERE fator_area = 'FATOR HUMANO'
+''')
+human_factor_conditioning = count('fator_humano', 'fator_condicionante')
+human_factor_conditioning
 
 # %%
-individual_factors = \
-    human_factor_conditioning[human_factor_conditioning.fator_condicionante == 'INDIVIDUAL']
-individual_factors.fator_nome.value_counts()
+hbar(human_factor_conditioning, 'Conditioning of human factors', 'category')
 
 # %%
-px.bar(
-    individual_factors['fator_nome'].value_counts().iloc[::-1],
-    orientation='h',
-    title='Individual contributing human factors',
-    labels={
-        'index': 'category',
-        'value': 'quantity',
-    }
+individual_factors = count(
+    'fator_humano',
+    'fator_nome',
+    where="fator_condicionante = 'INDIVIDUAL'"
 )
+individual_factors
 
 # %%
-organisational_factors = \
-    human_factor_conditioning[human_factor_conditioning.fator_condicionante == 'ORGANIZACIONAL']
-organisational_factors.fator_nome.value_counts()
+hbar(individual_factors, 'Individual contributing human factors', 'category')
 
 # %%
-px.bar(
-    organisational_factors['fator_nome'].value_counts().iloc[::-1],
-    orientation='h',
-    title='Organisational contributing human factors',
-    labels={
-        'index': 'category',
-        'value': 'quantity',
-    }
+organisational_factors = count(
+    'fator_humano',
+    'fator_nome',
+    where="fator_condicionante = 'ORGANIZACIONAL'"
 )
+organisational_factors
+
+# %%
+hbar(organisational_factors, 'Organisational contributing human factors', 'category')